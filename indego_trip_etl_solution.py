@@ -15,71 +15,113 @@ https://u626n26h74f16ig1p3pt0f2g-wpengine.netdna-ssl.com/wp-content/uploads/2021
 import logging
 import sqlite3
 import sys
-from typing import Dict, Iterable, TextIO
+from typing import Iterable, List, TextIO
 
 import csv
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
 
 
 logger = logging.getLogger()
 
+BATCH_SIZE = 10000
+READ_BUFFER_SIZE = 1 << 23  # 8 MB
+TIME_FORMAT = "%m/%d/%Y %H:%M"
+
+# csv column layout, rows are handled positionally in this order
+COLUMNS = ('trip_id', 'duration', 'start_time', 'end_time', 'start_station', 'start_lat', 'start_lon',
+           'end_station', 'end_lat', 'end_lon', 'bike_id', 'plan_duration', 'trip_route_category',
+           'passholder_type', 'bike_type')
+TRIP_ID_IDX = COLUMNS.index('trip_id')
+DURATION_IDX = COLUMNS.index('duration')
+START_TIME_IDX = COLUMNS.index('start_time')
+END_TIME_IDX = COLUMNS.index('end_time')
+BIKE_ID_IDX = COLUMNS.index('bike_id')
+PLAN_DURATION_IDX = COLUMNS.index('plan_duration')
+trip_id_key = itemgetter(TRIP_ID_IDX)
+
+# built once so every executemany reuses the same cached prepared statement
+INSERT_SQL = 'INSERT INTO trips ({}) VALUES ({})'.format(', '.join(COLUMNS), ','.join('?' * len(COLUMNS)))
+
+
+def batched(it: Iterable, n: int = BATCH_SIZE) -> Iterable[list]:
+    """Yield successive lists of at most n items from it"""
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
 def convert_float(s):
-    if str(s).isdigit() and '.' in str(s):
+    try:
         return float(s)
-    return None
+    except (TypeError, ValueError):
+        return None
 
 def convert_int(s):
-    if str(s).isdigit() and '.' not in str(s):
+    # plain ascii digits only, int() alone would also take signs, spaces and underscores
+    s = str(s)
+    if s.isascii() and s.isdigit():
         return int(s)
     return None
 
 
 # This is supplement function for converting to posix time
-def _convert_posix_time(value, value_format="%m/%d/%Y %H:%M"):
+# trip timestamps repeat at minute resolution, so cache the parsed values
+@lru_cache(maxsize=None)
+def _convert_posix_time(value):
+    # fast path: split the known m/d/Y H:M layout by hand (fields are not zero padded)
+    # and only trust it for plain ascii digits of the lengths strptime would accept
+    try:
+        date, _, clock = value.partition(' ')
+        month, day, year = date.split('/')
+        hour, minute = clock.split(':')
+        digits = month + day + year + hour + minute
+        if (digits.isascii() and digits.isdigit() and len(year) == 4
+                and all(1 <= len(f) <= 2 for f in (month, day, hour, minute))):
+            return datetime(int(year), int(month), int(day), int(hour), int(minute)).timestamp()
+    except ValueError:
+        pass
+    # fall back to strptime for anything unexpected, callers report failures
     try:
-        return datetime.strptime(value, value_format).timestamp()
-    except Exception as error:
-        logger.exception(error)
+        return datetime.strptime(value, TIME_FORMAT).timestamp()
+    except ValueError:
         return None
 # posix convert fields
-dict_transform = {'start_time': _convert_posix_time, 'end_time': _convert_posix_time}
+dict_transform = {START_TIME_IDX: _convert_posix_time, END_TIME_IDX: _convert_posix_time}
 
 
 # field check list
-dict_field_types = {'trip_id': convert_int, 'duration': convert_int, 'bike_id': convert_int, 'plan_duration': convert_int}
-def field_type_checker(field_name: str, field_type: str):
-    return dict_field_types[field_name] == type(field_type)
+dict_field_types = {TRIP_ID_IDX: convert_int, DURATION_IDX: convert_int, BIKE_ID_IDX: convert_int, PLAN_DURATION_IDX: convert_int}
+
+
+# flattened (index, converter, error message) schema, posix fields first, so each
+# row is checked in a single pass
+row_converters = tuple(
+    [(idx, func, "Error converting to posix time") for idx, func in dict_transform.items()]
+    + [(idx, func, "Error invalid data type for") for idx, func in dict_field_types.items()]
+)
 
 
 # This function is used to convert posix fields and check field types
-def field_checker(row: Dict):
-    return_row = row.copy()
-    error = False
-    
-    # loop through posix time fields
-    for trans_field_name, trans_field_function in dict_transform.items():
-        trans_value = trans_field_function(return_row[trans_field_name])
-        # print(trans_value)
-        if trans_value == None:
-            logger.exception(f"Error converting to posix time: {row}")
-            error = True
-            break
-        else:
-            return_row[trans_field_name] = trans_value
-    
-    # loop through number fields to check
-    if error != True:
-        for convert_field_name, convert_field_type in dict_field_types.items():
-            convert_value = convert_field_type(return_row[convert_field_name])
-            if  convert_value == None:
-                logger.exception(f"Error invalid data type for: {row}")
-                error = True
-                break
-            else:
-                return_row[convert_field_name] = convert_value
-    
-    if error != True:
-        return return_row
+# rows are converted in place, extract() yields a fresh list per row
+def field_checker(row: List):
+    if len(row) != len(COLUMNS):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Error wrong number of fields for: %s", row)
+        return None
+    for idx, convert, message in row_converters:
+        value = convert(row[idx])
+        if value is None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s: %s", message, row)
+            return None
+        row[idx] = value
+    return row
 
 
 def create_db(name: str = "trips.db") -> sqlite3.Connection:
@@ -93,13 +135,22 @@ def create_db(name: str = "trips.db") -> sqlite3.Connection:
     Note: This function should be idempotent
     """
     conn = sqlite3.connect(name)
-    
+
+    # tune for a single-writer bulk load
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+
     cur = conn.cursor()
 
-    cur.execute('''CREATE TABLE IF NOT EXISTS trips
-                   (trip_id integer primary key, duration integer, start_time text, end_time text, start_station integer, start_lat text, start_lon text, end_station text, end_lat text, end_lon text, bike_id integer, plan_duration integer, trip_route_category text, passholder_type text, bike_type text)''')
+    # start from an empty table; dropping it is a metadata change, unlike a row by row delete
+    cur.execute('DROP TABLE IF EXISTS trips')
 
-    cur.execute('delete from trips')
+    # trip_id is an integer primary key, i.e. an alias for the rowid, so there is
+    # no separate index to maintain during the load
+    cur.execute('''CREATE TABLE trips
+                   (trip_id integer primary key, duration integer, start_time text, end_time text, start_station integer, start_lat text, start_lon text, end_station text, end_lat text, end_lon text, bike_id integer, plan_duration integer, trip_route_category text, passholder_type text, bike_type text)''')
 
     return conn
 
@@ -111,50 +162,97 @@ def extract(file: TextIO) -> Iterable:
     1. Accept a file-like object (Text I/O)
     2. Return an iterable value to be transformed
     """
-    # use generator to return as iterable
-    for f in csv.DictReader(file):
-        yield f
+    # use generator to return as iterable of positional rows
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None or tuple(header) == COLUMNS:
+        # csv.reader returns [] for blank lines, skip them as DictReader did
+        yield from filter(None, reader)
+    else:
+        missing = [c for c in COLUMNS if c not in header]
+        if missing:
+            raise ValueError(f"csv header is missing columns: {', '.join(missing)}")
+        # columns are in a different order, pull them into COLUMNS order
+        get_values = itemgetter(*map(header.index, COLUMNS))
+        width = len(header)
+        for row in filter(None, reader):
+            if len(row) == width:
+                yield list(get_values(row))
+            else:
+                # a wrong-width row cannot be put into COLUMNS order, so pass on an
+                # empty row that field_checker always rejects (and transform counts)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Error wrong number of fields for: %s", row)
+                yield []
 
 
-def transform(rows: Iterable) -> Iterable[Dict]:
+def transform(rows: Iterable) -> Iterable[List]:
     """
     This function should:
 
     1. Accept an iterable rows value to be transformed
     2. Transform any date time value into a POSIX timestamp
     3. Transform remaining fields into sqlite3 supported types
-    4. Output to stdout or stderr if a row fails to be transformed
-    5. Return an iterable collection of transformed rows as trip dictionaries to be loaded into our trips table
+    4. Output to stdout or stderr if rows fail to be transformed (a single count, per row detail at DEBUG)
+    5. Return an iterable collection of transformed rows as trip lists to be loaded into our trips table
     """
-    for r in rows:
-        row = field_checker(r)
+    # per-row tracing is only built when debug logging is enabled
+    debug = logger.isEnabledFor(logging.DEBUG)
+    bad_rows = 0
+    # field_checker converts rows in place and returns None for rows it rejects
+    for row in map(field_checker, rows):
         if row:
+            if debug:
+                logger.debug('transform: %s', row)
             yield row
+        else:
+            bad_rows += 1
+    if bad_rows:
+        logger.warning('skipped %d rows that failed to transform', bad_rows)
 
 
-def load(trips: Iterable[Dict], conn: sqlite3.Connection):
+def load(trips: Iterable[List], conn: sqlite3.Connection):
     """
     This function should:
 
     1. Accept a collection of trip object data and a connection to the trip database
     2. Insert the trip records into the database
     """
-    for t in trips:
-        if t:
-            # print(t)
+    cur = conn.cursor()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    bad_rows = 0
+    # run every insert inside one transaction, committed on exit
+    with conn:
+        for chunk in batched(filter(None, trips), BATCH_SIZE):
+            # insert in trip_id order so the rowid b-tree is appended to sequentially
+            chunk.sort(key=trip_id_key)
+            # executemany stops at the first row it cannot insert, leaving the rest
+            # of the batch in `pending`; those are retried one row at a time
+            pending = iter(chunk)
             try:
-                cur = conn.cursor()
-                cur.execute('INSERT INTO trips VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', tuple(t.values()))
-            except Exception as error:
-                logger.exception('error inserting int trips table', t)
-    conn.commit()
-    cur.execute('select * from trips')
+                cur.executemany(INSERT_SQL, pending)
+            except sqlite3.Error:
+                # the failing row has already been taken from `pending`
+                bad_rows += 1
+                if debug:
+                    logger.debug('error inserting into trips table', exc_info=True)
+                for t in pending:
+                    try:
+                        cur.execute(INSERT_SQL, t)
+                    except sqlite3.Error:
+                        bad_rows += 1
+                        if debug:
+                            logger.debug('error inserting into trips table: %s', t, exc_info=True)
+    if bad_rows:
+        logger.warning('skipped %d rows that failed to insert', bad_rows)
 
 
 def main(fname) -> None:
     """Given an indego bike trip csv file, run our ETL process on it for further querying"""
     conn = create_db()
-    with open(fname) as f:
+    # newline='' as the csv module expects, with a large buffer to cut down on read calls,
+    # and utf-8-sig so a byte order mark does not end up in the first header name
+    with open(fname, 'r', buffering=READ_BUFFER_SIZE, newline='', encoding='utf-8-sig') as f:
         rows = extract(f)
         trip_objs = transform(rows)
         load(trip_objs, conn)
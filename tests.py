@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import io
 import unittest
+from datetime import datetime
 from typing import Iterable
+from unittest import mock
 
 import indego_trip_etl_solution as indego_trip_etl
 
@@ -37,17 +39,19 @@ class EtlTestCase(unittest.TestCase):
 
     def test_2_transform(self):
         trip_cnt = 0
-        for trip in indego_trip_etl.transform(self.rows):
-            trip_cnt += 1
-            self.trips.append(trip)
+        with self.assertLogs(level="WARNING") as logs:
+            for trip in indego_trip_etl.transform(self.rows):
+                trip_cnt += 1
+                self.trips.append(trip)
         self.assertEqual(trip_cnt, 2)
+        self.assertIn("skipped 2 rows", logs.output[0])
         self.assertEqual(
             set([1617256140.0, 1617252240.0]),
-            set([t["start_time"] for t in self.trips]),
+            set([t[indego_trip_etl.START_TIME_IDX] for t in self.trips]),
         )
         self.assertNotEqual(
             "1892816508",
-            sum([t["bike_id"] for t in self.trips]),
+            sum([t[indego_trip_etl.BIKE_ID_IDX] for t in self.trips]),
         )
 
     def test_3_load(self):
@@ -61,5 +65,120 @@ class EtlTestCase(unittest.TestCase):
         self.assertEqual(ss_sum[0], 6427)
 
 
+def make_trip(trip_id):
+    return [trip_id, 7, 1617252240.0, 1617252660.0, 3213, "39.938869", "-75.166634", "3000", "", "",
+            18928, 30, "One Way", "Indego30", "electric"]
+
+
+class LoadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = indego_trip_etl.create_db(name=":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def count(self):
+        return self.conn.execute("SELECT count(*) from trips").fetchone()[0]
+
+    def test_duplicate_trip_id(self):
+        trips = [make_trip(1)] + [make_trip(i) for i in range(1, 50)]
+        with self.assertLogs(level="WARNING") as logs:
+            indego_trip_etl.load(trips, self.conn)
+        self.assertEqual(self.count(), 49)
+        self.assertEqual(logs.output, ["WARNING:root:skipped 1 rows that failed to insert"])
+
+    def test_wrong_field_count(self):
+        # the bad row sorts first in its batch, the rows after it must still load
+        trips = [make_trip(2), make_trip(1) + ["extra"], make_trip(3)]
+        with self.assertLogs(level="WARNING"):
+            indego_trip_etl.load(trips, self.conn)
+        self.assertEqual(self.count(), 2)
+
+    def test_failure_across_batches(self):
+        trips = [make_trip(i) for i in range(1, 11)] + [make_trip(5)]
+        with mock.patch.object(indego_trip_etl, "BATCH_SIZE", 3), self.assertLogs(level="WARNING") as logs:
+            indego_trip_etl.load(trips, self.conn)
+        self.assertEqual(self.count(), 10)
+        self.assertIn("skipped 1 rows", logs.output[0])
+
+
+class ExtractTestCase(unittest.TestCase):
+    def test_reordered_header(self):
+        lines = sample_csv.strip().splitlines()
+        reordered = "\n".join(",".join(reversed(line.split(","))) for line in lines)
+        expected = list(indego_trip_etl.extract(io.StringIO(sample_csv.strip())))
+        self.assertEqual(list(indego_trip_etl.extract(io.StringIO(reordered))), expected)
+
+    def test_reordered_header_wrong_width(self):
+        header = list(indego_trip_etl.COLUMNS)
+        header[4], header[7] = header[7], header[4]
+        header.append("note")
+        good = "1,7,4/1/2021 0:44,4/1/2021 0:51,END,1,2,START,,,18928,30,One Way,Indego30,electric,x"
+        short = "2,7,4/1/2021 0:44,4/1/2021 0:51,END,1,2,START,,,18928,30,One Way,Indego30,electric"
+        text = "\n".join([",".join(header), good, short])
+        with self.assertLogs(level="WARNING") as logs:
+            trips = list(indego_trip_etl.transform(indego_trip_etl.extract(io.StringIO(text))))
+        self.assertIn("skipped 1 rows", logs.output[0])
+        self.assertEqual(len(trips), 1)
+        self.assertEqual(trips[0][0], 1)
+        self.assertEqual((trips[0][4], trips[0][7]), ("START", "END"))
+
+    def test_quoted_field(self):
+        text = sample_csv.replace(",One Way,", ',"Station ""A"", West",', 1)
+        rows = list(indego_trip_etl.extract(io.StringIO(text)))
+        self.assertEqual(len(rows[0]), len(indego_trip_etl.COLUMNS))
+        self.assertEqual(rows[0][12], 'Station "A", West')
+
+    def test_missing_column(self):
+        text = sample_csv.replace(",bike_type\n", "\n", 1)
+        with self.assertRaisesRegex(ValueError, "missing columns: bike_type"):
+            list(indego_trip_etl.extract(io.StringIO(text)))
+
+
+class MalformedRowsTestCase(unittest.TestCase):
+    def transform(self, text):
+        return list(indego_trip_etl.transform(indego_trip_etl.extract(io.StringIO(text))))
+
+    def test_blank_lines(self):
+        lines = sample_csv.strip().splitlines()
+        text = "\n".join(lines[:2] + [""] + lines[2:]) + "\n\n"
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(len(self.transform(text)), 2)
+
+    def test_short_row(self):
+        text = sample_csv + "5,7,4/1/2021 0:44,4/1/2021 0:51,3213\n"
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertEqual(len(self.transform(text)), 2)
+        self.assertIn("skipped 3 rows", logs.output[0])
+
+
+class ConvertTestCase(unittest.TestCase):
+    def test_convert_int(self):
+        self.assertEqual(indego_trip_etl.convert_int("18928"), 18928)
+        self.assertIsNone(indego_trip_etl.convert_int("1650z"))
+        self.assertIsNone(indego_trip_etl.convert_int("39.93"))
+        self.assertIsNone(indego_trip_etl.convert_int(None))
+        for value in ("1_000", " 7 ", "+7", "-7", "\u0664"):
+            self.assertIsNone(indego_trip_etl.convert_int(value))
+
+    def test_convert_float(self):
+        self.assertEqual(indego_trip_etl.convert_float("39.938869"), 39.938869)
+        self.assertEqual(indego_trip_etl.convert_float("-75.166634"), -75.166634)
+        self.assertIsNone(indego_trip_etl.convert_float(""))
+        self.assertIsNone(indego_trip_etl.convert_float(None))
+
+
+class ConvertPosixTimeTestCase(unittest.TestCase):
+    def test_matches_strptime(self):
+        for value in ("4/1/2021 0:44", "04/01/2021 00:44", "12/31/2021 23:59"):
+            expected = datetime.strptime(value, "%m/%d/%Y %H:%M").timestamp()
+            self.assertEqual(indego_trip_etl._convert_posix_time(value), expected)
+
+    def test_invalid(self):
+        for value in ("99/100/2021 1:49", "4/1/2021", "", "4/1/21 0:44", "1_2/1/2021 0:44",
+                      "+4/1/2021 0:44", "\u0664/1/2021 0:44", "4/1/2021 0:44 "):
+            self.assertIsNone(indego_trip_etl._convert_posix_time(value))
+
+
 if __name__ == "__main__":
     unittest.main()